@@ -0,0 +1,27 @@
+-- indexes and a materialized view backing the dashboard's latest-trade
+-- lookups; safe to run more than once
+--
+--   psql -d munis -f latest_trades.sql
+
+-- bond -> trade lookups for a single bond (bond explorer)
+CREATE INDEX IF NOT EXISTS bonds_trades_bond_id_idx
+  ON bonds_trades (bond_id, trade_id);
+
+-- lets the trade side of those joins be answered from the index alone
+CREATE INDEX IF NOT EXISTS trades_id_covering_idx
+  ON trades (id) INCLUDE (date, price, yield);
+
+-- the most recent trade of every bond (market overview price vs yield)
+CREATE MATERIALIZED VIEW IF NOT EXISTS latest_trades AS
+  SELECT DISTINCT ON (bt.bond_id)
+    bt.bond_id, t.price, t.yield, t.date
+  FROM bonds_trades bt
+  JOIN trades t ON t.id = bt.trade_id
+  ORDER BY bt.bond_id, t.date DESC;
+
+-- needed for REFRESH MATERIALIZED VIEW CONCURRENTLY
+CREATE UNIQUE INDEX IF NOT EXISTS latest_trades_bond_id_idx
+  ON latest_trades (bond_id);
+
+-- rerun after loading new trades (e.g. from cron) to pick them up:
+--   REFRESH MATERIALIZED VIEW CONCURRENTLY latest_trades;
@@ -1,91 +1,252 @@
 import streamlit as st
 import pandas as pd
-import altair as alt
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import text
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+
+# one pooled engine for the whole app; extra st.connection kwargs are passed
+# straight to sqlalchemy.create_engine
+@st.cache_resource
+def get_conn():
+  return st.connection(
+    "postgresql",
+    type = "sql",
+    pool_size = 4,
+    pool_pre_ping = False,
+    pool_recycle = 1800,
+  )
 
-conn = st.connection("postgresql", type = "sql")
+# uncached query straight through the pooled engine. the st.cache_data
+# loaders use this, since conn.query would cache every result a second time
+def read_sql(sql, params = None):
+  with get_conn().engine.connect() as con:
+    return pd.read_sql(text(sql), con, params = params)
+
+# run independent queries at the same time; takes {name: (sql, params)}
+# and returns {name: dataframe}. each worker checks out its own pooled
+# connection, and gets the script context so get_conn() works off-thread
+def run_parallel(queries):
+  ctx = get_script_run_ctx()
+
+  with ThreadPoolExecutor(
+    max_workers = 4, initializer = add_script_run_ctx, initargs = (None, ctx)
+  ) as pool:
+    futures = {
+      name: pool.submit(read_sql, sql, params)
+      for name, (sql, params) in queries.items()
+    }
+    return {name: future.result() for name, future in futures.items()}
+
+# credit ratings from best to worst
+RATING_ORDER = [ # i think this is right?
+  "AAA", "AA+", "AA", "AA-", "A+", "A", "A-",
+  "BBB+", "BBB", "BBB-", "BB+", "BB", "BB-",
+  "B+", "B", "B-", "CCC+", "CCC", "CCC-", "CC",
+  "C", "D"
+]
+RATING_RANK = {r: i for i, r in enumerate(RATING_ORDER)}
+
+# same ranking as a SQL expression, unknown ratings sort as the riskiest
+RATING_RANK_SQL = (
+  "CASE cr.rating "
+  + " ".join(f"WHEN '{r}' THEN {i}" for r, i in RATING_RANK.items())
+  + " ELSE 999 END"
+)
+
+# number of yield histogram buckets, spread over the filtered coupon range
+YIELD_BINS = 30
+
+# streamlit drops the state of widgets on pages that aren't rendered, so each
+# filter also keeps its value under a separate "saved_" key and starts from
+# it when its page comes back
+def remembered(key, options, default):
+  value = st.session_state.get(f"saved_{key}", default)
+  if isinstance(value, list):
+    return [v for v in value if v in options] # options may have changed
+  return value
+
+def remember(key, value):
+  st.session_state[f"saved_{key}"] = value
+  return value
+
+# index of a remembered selectbox choice, falling back to the first option
+def remembered_index(key, options):
+  value = remembered(key, options, None)
+  return options.index(value) if value in options else 0
+
+# fetch the DISTINCT values of several columns in one round trip; takes
+# {kind: (table, column)} and returns {kind: [sorted values]}
+def load_filter_values(columns):
+  sql = " UNION ALL ".join(
+    f"SELECT DISTINCT '{kind}' AS kind, {col}::text AS val FROM {table}"
+    for kind, (table, col) in columns.items()
+  ) + " ORDER BY kind, val;"
+
+  df = get_conn().query(sql, ttl = "10m")
+  groups = {k: g["val"].tolist() for k, g in df.groupby("kind")}
+  return {kind: groups.get(kind, []) for kind in columns}
+
+# FROM/WHERE shared by the market overview queries. an empty filter is
+# passed as NULL rather than left out, so the statement text is the same
+# for every combination of filters
+def market_filters(selected_states, selected_types, selected_purposes):
+  joins = """
+    FROM bonds b
+    LEFT JOIN bonds_issuers bi ON bi.bond_id = b.id
+    LEFT JOIN issuers i ON bi.issuer_id = i.id
+    LEFT JOIN bonds_purposes bp ON bp.id = b.purpose_id
+  """
 
-# main heading
-st.header("📊 M U N I S")
-# st.subheader("A dashboard for the municipal bond market")
+  where_clause = """
+    WHERE (:states IS NULL OR i.state = ANY(:states))
+      AND (:types IS NULL OR b.type = ANY(:types))
+      AND (:purposes IS NULL OR bp.category = ANY(:purposes))
+  """
 
-# our tabs
-market_tab, bonds_tab, risk_tab, state_compare_tab = st.tabs([
-  "Market Overview",
-  "Bond Explorer",
-  "Ratings & Risk",
-  "State Compare"
-])
+  params = {
+    "states": list(selected_states) or None,
+    "types": list(selected_types) or None,
+    "purposes": list(selected_purposes) or None,
+  }
 
-# all the market overview code goes in here
-def render_market_overview():
-  st.header("📈 Market Overview")
+  return joins, where_clause, params
 
-  states = conn.query(
-    "SELECT DISTINCT state FROM issuers ORDER BY state;", ttl = "10m"
-  )["state"].tolist()
-  types = conn.query(
-    "SELECT DISTINCT type FROM bonds ORDER BY type;", ttl = "10m"
-  )["type"].tolist()
-  purposes = conn.query(
-    "SELECT DISTINCT category FROM bonds_purposes ORDER BY category;", ttl = "10m"
-  )["category"].tolist()
+# loads and shapes everything the market overview draws; the filters are
+# passed as tuples so the whole result can be cached per selection
+@st.cache_data(ttl = "2m")
+def load_market(selected_states, selected_types, selected_purposes):
+  joins, where_clause, params = market_filters(
+    selected_states, selected_types, selected_purposes
+  )
 
-  col1, col2, col3 = st.columns(3)
-  selected_states = col1.multiselect("Filter by State", states)
-  selected_types = col1.multiselect("Filter by Bond Type", types)
-  selected_purposes = col1.multiselect("Filter by Purpose Category", purposes)
+  # loading yield data, only the columns the metrics and curve use
+  sql = f"""
+    SELECT
+      b.coupon_rate, b.duration,
+      EXTRACT(YEAR FROM b.maturity_date)::int AS maturity_year
+    {joins}
+    {where_clause};
+  """
 
-  # building the WHERE clause
-  where = []
-  params = {}
+  # histogram bucket between the filtered min and max coupon. width_bucket
+  # puts the max itself one past the end, so it's folded into the last bucket,
+  # and a range of a single value (which width_bucket rejects) is one bucket
+  bucket = f"""
+    CASE
+      WHEN f.coupon_rate IS NULL THEN NULL
+      WHEN bounds.hi = bounds.lo THEN 1
+      ELSE LEAST(
+        width_bucket(f.coupon_rate, bounds.lo, bounds.hi, {YIELD_BINS}), {YIELD_BINS}
+      )
+    END
+  """
 
-  if selected_states: 
-    where.append("i.state = ANY(:states)")
-    params["states"] = selected_states
+  # chart aggregates: yield histogram buckets and per-state averages
+  agg_sql = f"""
+    WITH filtered AS (
+      SELECT b.coupon_rate, i.state
+      {joins}
+      {where_clause}
+    ), bounds AS (
+      SELECT min(coupon_rate) AS lo, max(coupon_rate) AS hi FROM filtered
+    )
+    SELECT
+      CASE WHEN GROUPING(f.state) = 1 THEN 'bin' ELSE 'state' END AS kind,
+      {bucket} AS bin,
+      f.state,
+      count(*) AS bonds,
+      avg(f.coupon_rate) AS avg_coupon,
+      min(bounds.lo)::float8 AS lo,
+      min(bounds.hi)::float8 AS hi
+    FROM filtered f
+    CROSS JOIN bounds
+    GROUP BY GROUPING SETS (({bucket}), (f.state));
+  """
+  results = run_parallel({"df": (sql, params), "agg": (agg_sql, params)})
+  df, agg = results["df"], results["agg"]
+
+  hist = agg[agg["kind"] == "bin"].dropna(subset=["bin"]).copy()
+  width = (hist["hi"] - hist["lo"]) / YIELD_BINS
+  hist["bin_start"] = hist["lo"] + (hist["bin"] - 1) * width
+  hist["bin_end"] = hist["bin_start"] + width
+
+  # every coupon is the same: draw one narrow bar centred on it
+  same = width == 0
+  hist.loc[same, "bin_start"] = hist.loc[same, "lo"] - 0.125
+  hist.loc[same, "bin_end"] = hist.loc[same, "lo"] + 0.125
+
+  state_yield = (
+    agg[agg["kind"] == "state"].dropna(subset=["state"])
+    .set_index("state")["avg_coupon"]
+    .sort_values(ascending=False)
+    .head(10)
+  )
 
-  if selected_types:
-    where.append("b.type = ANY(:types)")
-    params["types"] = selected_types
+  # groupby already sorts by year, and line_chart takes the series as-is
+  curve = df.groupby("maturity_year", sort=True)["coupon_rate"].mean()
+  curve.index.name = "index"
 
-  if selected_purposes:
-    where.append("bp.category = ANY(:purposes)")
-    params["purposes"] = selected_purposes
+  return df, curve, hist, state_yield
 
-  where_clause = "WHERE " + " AND ".join(where) if where else ""
+# the latest trade of every matching bond, only loaded when the scatter is
+# shown; reads the latest_trades materialized view from latest_trades.sql
+@st.cache_data(ttl = "2m")
+def load_market_trades(selected_states, selected_types, selected_purposes):
+  joins, where_clause, params = market_filters(
+    selected_states, selected_types, selected_purposes
+  )
 
-  # loading yield data
   sql = f"""
     SELECT
-      b.coupon_rate, b.duration, b.maturity_date, b.issue_date, b.cusip,
-      i.state, b.type, bp.category AS purpose,
+      b.cusip, i.state, b.type, bp.category AS purpose,
       t.price, t.yield
-    FROM bonds b
-    LEFT JOIN bonds_issuers bi ON bi.bond_id = b.id
-    LEFT JOIN issuers i ON bi.issuer_id = i.id
-    LEFT JOIN bonds_purposes bp ON bp.id = b.purpose_id
-    LEFT JOIN LATERAL (
-      SELECT tr.price, tr.yield
-      FROM trades tr
-      JOIN bonds_trades bt ON bt.trade_id = tr.id
-      WHERE bt.bond_id = b.id
-      ORDER BY tr.date DESC
-      LIMIT 1
-    ) t ON TRUE
-    {where_clause}
-    ORDER BY maturity_date;
+    {joins}
+    JOIN latest_trades t ON t.bond_id = b.id
+    {where_clause};
   """
 
-  df = conn.query(sql, params = params or None, ttl = "2m")
+  df = read_sql(sql, params)
+  return df.dropna(subset=["price", "yield"])
+
+# all the market overview code goes in here. each page is a fragment, so
+# its widgets only rerun that page instead of the whole script
+@st.fragment
+def render_market_overview():
+  st.header("📈 Market Overview")
+
+  filters = load_filter_values({
+    "state": ("issuers", "state"),
+    "type": ("bonds", "type"),
+    "purpose": ("bonds_purposes", "category"),
+  })
+  states = filters["state"]
+  types = filters["type"]
+  purposes = filters["purpose"]
+
+  col1, col2, col3 = st.columns(3)
+  selected_states = remember("market_states", col1.multiselect(
+    "Filter by State", states, key = "market_states",
+    default = remembered("market_states", states, []),
+  ))
+  selected_types = remember("market_types", col1.multiselect(
+    "Filter by Bond Type", types, key = "market_types",
+    default = remembered("market_types", types, []),
+  ))
+  selected_purposes = remember("market_purposes", col1.multiselect(
+    "Filter by Purpose Category", purposes, key = "market_purposes",
+    default = remembered("market_purposes", purposes, []),
+  ))
+
+  filter_key = (
+    tuple(sorted(selected_states)),
+    tuple(sorted(selected_types)),
+    tuple(sorted(selected_purposes)),
+  )
+  df, curve, hist, state_yield = load_market(*filter_key)
   if df.empty:
     st.warning("No bonds match your filter selections")
     return
 
-  # derived fields
-  df["maturity_date"] = pd.to_datetime(df["maturity_date"])
-  df["issue_date"] = pd.to_datetime(df["issue_date"]) # convert to datetime first
-  df["maturity_year"] = df["maturity_date"].dt.year
-  df["years_to_maturity"] = (df["maturity_date"] - df["issue_date"]).dt.days / 365.0
-
   st.subheader("Aggregate Market Metrics")
   colA, colB, colC = st.columns(3)
   colA.metric("Avg Coupon", f"{df['coupon_rate'].mean():.2f}%")
@@ -97,260 +258,304 @@ def render_market_overview():
   # yield curve
   st.subheader("Yield Curve (Approximate)")
   
-  curve_df = (
-    df.groupby("maturity_year")["coupon_rate"]
-    .mean()
-    .reset_index()
-    .sort_values("maturity_year")
-  )
-  
-  st.line_chart(
-    curve_df.rename(columns={"maturity_year": "index"}).set_index("index")
-  )
+  st.line_chart(curve)
   st.caption("This shows average coupon/yield grouped by maturity year.")
 
   st.divider()
 
   # yield distribution
   st.subheader("Distribution of Yields")
-  chart = (
-    alt.Chart(df)
-    .mark_bar()
-    .encode(
-      alt.X("coupon_rate:Q", bin=alt.Bin(maxbins=30), title="Yield (%)"),
-      alt.Y("count()", title="Number of Bonds"),
-      tooltip=[alt.Tooltip("count()", title="Count")]
-    )
-    .properties(height=300)
-  )
-  st.altair_chart(chart, use_container_width=True)
+  # plain vega-lite dicts skip altair's spec building on every rerun
+  chart = {
+    "mark": "bar",
+    "encoding": {
+      "x": {
+        "field": "bin_start", "type": "quantitative", "bin": "binned",
+        "title": "Yield (%)"
+      },
+      "x2": {"field": "bin_end"},
+      "y": {"field": "bonds", "type": "quantitative", "title": "Number of Bonds"},
+      "tooltip": [{"field": "bonds", "type": "quantitative", "title": "Count"}],
+    },
+    "height": 300,
+  }
+  st.vega_lite_chart(hist, chart, use_container_width=True)
   st.divider()
 
   # bond price vs yield
   st.subheader("Bond Price vs Yield")
 
-  df_scatter = df.dropna(subset=["price", "yield"])
-
-  # ensure price and yield exist (must join trades table)
-  if "price" in df.columns and "yield" in df.columns:
-    chart = (
-      alt.Chart(df_scatter)
-      .mark_line(point=True)
-      .encode(
-        x=alt.X("price:Q", title="Price ($)"),
-        y=alt.Y("mean(yield):Q", title="Average Yield (%)"),
-        color=alt.Color("state:N", title="State"),
-        # color=alt.Color("maturity_bucket:N"),
-        tooltip=[
-          alt.Tooltip("cusip:N", title="CUSIP"),
-          alt.Tooltip("yield:Q", format=".2f"),
-          alt.Tooltip("price:Q", format=".2f"),
-          "state:N",
-          "type:N",
-          "purpose:N",
-        ]
-      )
-      .interactive()
-      .properties(height=350)
-    )
-    st.altair_chart(chart, use_container_width=True)
-    st.caption("Higher yields typically correspond to lower prices — showing the inverse price/yield relationship.")
+  # this one joins every bond's latest trade, so it's opt-in
+  show_trades = remember("market_show_trades", st.toggle(
+    "Show latest trade prices", key = "market_show_trades",
+    value = remembered("market_show_trades", None, False),
+  ))
+  if show_trades:
+    df_scatter = load_market_trades(*filter_key)
+
+    if not df_scatter.empty:
+      chart = {
+        "mark": {"type": "line", "point": True},
+        "encoding": {
+          "x": {"field": "price", "type": "quantitative", "title": "Price ($)"},
+          "y": {
+            "field": "yield", "type": "quantitative", "aggregate": "mean",
+            "title": "Average Yield (%)"
+          },
+          "color": {"field": "state", "type": "nominal", "title": "State"},
+          # "color": {"field": "maturity_bucket", "type": "nominal"},
+          "tooltip": [
+            {"field": "cusip", "type": "nominal", "title": "CUSIP"},
+            {"field": "yield", "type": "quantitative", "format": ".2f"},
+            {"field": "price", "type": "quantitative", "format": ".2f"},
+            {"field": "state", "type": "nominal"},
+            {"field": "type", "type": "nominal"},
+            {"field": "purpose", "type": "nominal"},
+          ],
+        },
+        "params": [{"name": "zoom", "select": "interval", "bind": "scales"}],
+        "height": 350,
+      }
+      st.vega_lite_chart(df_scatter, chart, use_container_width=True)
+      st.caption("Higher yields typically correspond to lower prices — showing the inverse price/yield relationship.")
+    else:
+      st.info("Trade price & yield data unavailable at this level — view details in Bond Explorer.")
   else:
-    st.info("Trade price & yield data unavailable at this level — view details in Bond Explorer.")
+    st.caption("Turn on to load each bond's most recent trade.")
   st.divider()
 
   # state comparison
   if not selected_states:
     st.subheader("Top States by Average Yield")
-    state_yield = (
-      df.groupby("state")["coupon_rate"]
-      .mean()
-      .sort_values(ascending=False)
-      .head(10)
-    )
     st.bar_chart(state_yield)
     st.caption("Shows which states tend to have higher yields.")
 
+# loads and shapes everything the ratings page draws, cached per selection
+@st.cache_data(ttl = "2m")
+def load_ratings(selected_states, selected_agencies, selected_outlooks):
+  # empty filters are passed as NULL, like in market_filters()
+  from_clause = """
+    FROM credit_ratings cr
+    JOIN bonds_credit_ratings bcr ON bcr.credit_id = cr.id
+    JOIN bonds b ON b.id = bcr.bond_id
+    LEFT JOIN bonds_issuers bi ON bi.bond_id = b.id
+    LEFT JOIN issuers i ON i.id = bi.issuer_id
+    WHERE (:states IS NULL OR i.state = ANY(:states))
+      AND (:agencies IS NULL OR cr.agency = ANY(:agencies))
+      AND (:outlooks IS NULL OR cr.outlook = ANY(:outlooks))
+  """
+
+  params = {
+    "states": list(selected_states) or None,
+    "agencies": list(selected_agencies) or None,
+    "outlooks": list(selected_outlooks) or None,
+  }
+
+  # summary metrics (the empty grouping set), then chart aggregates per
+  # rating and per rating within each state. level is 3 for the totals row,
+  # 1 per rating and 0 per (rating, state)
+  agg_sql = f"""
+    SELECT
+      GROUPING(cr.rating, i.state) AS level,
+      cr.rating, i.state,
+      count(*) AS bonds,
+      avg(b.coupon_rate) AS avg_coupon,
+      count(DISTINCT cr.rating) AS ratings
+    {from_clause}
+    GROUP BY GROUPING SETS ((), (cr.rating), (cr.rating, i.state));
+  """
+
+  # latest rating per bond, then the 10 newest of those
+  recent_sql = f"""
+    SELECT * FROM (
+      SELECT DISTINCT ON (b.cusip)
+        cr.date AS rating_date, b.cusip, i.name AS issuer_name,
+        cr.rating, cr.outlook
+      {from_clause}
+      ORDER BY b.cusip, cr.date DESC
+    ) latest
+    ORDER BY rating_date DESC
+    LIMIT 10;
+  """
+
+  # only the 10 worst rows are shown, so let postgres pick them
+  risky_sql = f"""
+    SELECT
+      cr.rating, cr.outlook, b.cusip, i.name AS issuer_name, b.coupon_rate
+    {from_clause}
+    ORDER BY {RATING_RANK_SQL} DESC, cr.date DESC
+    LIMIT 10;
+  """
+
+  # none of these depend on each other, so send them together
+  results = run_parallel({
+    "agg": (agg_sql, params),
+    "recent": (recent_sql, params),
+    "risky": (risky_sql, params),
+  })
+
+  recent_updates = results["recent"]
+  risky = results["risky"]
+
+  agg = results["agg"]
+  totals = agg[agg["level"] == 3].iloc[0]
+  by_rating = agg[agg["level"] == 1]
+  by_rating_state = agg[agg["level"] == 0]
+
+  return totals, by_rating, by_rating_state, recent_updates, risky
+
 # all the "ratings & risk" page code goes in here
+@st.fragment
 def render_ratings_risk():
   st.header("🚨 Ratings & Risk")
 
   # loading filter values
-  state_list = conn.query(
-    "SELECT DISTINCT state FROM issuers ORDER BY state;", ttl="10m"
-  )["state"].tolist()
-  
-  agencies = conn.query(
-    "SELECT DISTINCT agency FROM credit_ratings ORDER BY agency;", ttl="10m"
-  )["agency"].tolist()
-  
-  outlooks = conn.query(
-    "SELECT DISTINCT outlook FROM credit_ratings ORDER BY outlook;", ttl="10m"
-  )["outlook"].tolist()
+  filters = load_filter_values({
+    "state": ("issuers", "state"),
+    "agency": ("credit_ratings", "agency"),
+    "outlook": ("credit_ratings", "outlook"),
+  })
+  state_list = filters["state"]
+  agencies = filters["agency"]
+  outlooks = filters["outlook"]
 
   # filtering UI
   c1, c2, c3 = st.columns(3)
-  selected_states = c1.multiselect("State", state_list)
-  selected_agencies = c2.multiselect("Rating Agency", agencies)
-  selected_outlooks = c3.multiselect("Outlook", outlooks)
-
-  # building WHERE clause
-  where = []
-  params = {}
-  
-  if selected_states:
-    where.append("i.state = ANY(:states)")
-    params["states"] = selected_states
-  
-  if selected_agencies:
-    where.append("cr.agency = ANY(:agencies)")
-    params["agencies"] = selected_agencies
-  
-  if selected_outlooks:
-    where.append("cr.outlook = ANY(:outlooks)")
-    params["outlooks"] = selected_outlooks
-
-  where_clause = "WHERE " + " AND ".join(where) if where else ""
-
-  # loading the joined rating data
-  sql = f"""
-    SELECT
-      b.cusip, b.coupon_rate, b.duration, b.type,
-      i.name AS issuer_name, i.state,
-      cr.agency, cr.date AS rating_date, cr.rating, cr.outlook
-    FROM credit_ratings cr
-    JOIN bonds_credit_ratings bcr ON bcr.credit_id = cr.id
-    JOIN bonds b ON b.id = bcr.bond_id
-    LEFT JOIN bonds_issuers bi ON bi.bond_id = b.id
-    LEFT JOIN issuers i ON i.id = bi.issuer_id
-    {where_clause}
-    ORDER BY cr.date DESC;
-  """
-  
-  df = conn.query(sql, params=params or None, ttl="2m")
+  selected_states = remember("risk_states", c1.multiselect(
+    "State", state_list, key = "risk_states",
+    default = remembered("risk_states", state_list, []),
+  ))
+  selected_agencies = remember("risk_agencies", c2.multiselect(
+    "Rating Agency", agencies, key = "risk_agencies",
+    default = remembered("risk_agencies", agencies, []),
+  ))
+  selected_outlooks = remember("risk_outlooks", c3.multiselect(
+    "Outlook", outlooks, key = "risk_outlooks",
+    default = remembered("risk_outlooks", outlooks, []),
+  ))
+
+  totals, by_rating, by_rating_state, recent_updates, risky = load_ratings(
+    tuple(sorted(selected_states)),
+    tuple(sorted(selected_agencies)),
+    tuple(sorted(selected_outlooks)),
+  )
 
-  if df.empty:
+  if totals["bonds"] == 0:
     st.warning("No rating data available for the selected filters.")
     return
 
-  # parsing date col directly
-  df["rating_date"] = pd.to_datetime(df["rating_date"])
-  
   st.subheader("Summary Metrics")
   cA, cB, cC = st.columns(3)
-  cA.metric("Total Rated Bonds", len(df))
-  cB.metric("Avg Coupon", f"{df['coupon_rate'].mean():.2f}%")
-  cC.metric("Unique Rating Grades", df["rating"].nunique())
+  cA.metric("Total Rated Bonds", int(totals["bonds"]))
+  cB.metric("Avg Coupon", f"{totals['avg_coupon']:.2f}%")
+  cC.metric("Unique Rating Grades", int(totals["ratings"]))
   st.divider()
 
   # rating distribution
   st.subheader("Distribution of Credit Ratings")
   
-  chart = (
-    alt.Chart(df)
-    .mark_bar()
-    .encode(
-      x=alt.X("rating:N", sort="descending"),
-      y=alt.Y("count()", title="Number of Bonds"),
-      tooltip=["rating", "count()"],
-      color=alt.Color("rating:N", legend=None),
-    )
-    .properties(height=300)
-  )
-  st.altair_chart(chart, use_container_width=True)
+  chart = {
+    "mark": "bar",
+    "encoding": {
+      "x": {"field": "rating", "type": "nominal", "sort": "descending"},
+      "y": {"field": "bonds", "type": "quantitative", "title": "Number of Bonds"},
+      "tooltip": [
+        {"field": "rating", "type": "nominal"},
+        {"field": "bonds", "type": "quantitative"},
+      ],
+      "color": {"field": "rating", "type": "nominal", "legend": None},
+    },
+    "height": 300,
+  }
+  st.vega_lite_chart(by_rating, chart, use_container_width=True)
   st.divider()
 
   # rating vs yield
   st.subheader("Yield (Coupon) vs Credit Rating")
   
   
-  line_chart = (
-      alt.Chart(df)
-      .mark_line(point=True)  # points on the line
-      .encode(
-          x=alt.X("rating:N", sort="descending"),
-          y=alt.Y("mean(coupon_rate):Q", title="Average Coupon (%)"),
-          color=alt.Color("state:N", title="State"),
-          tooltip=[
-              "state:N",
-              alt.Tooltip("mean(coupon_rate):Q", title="Avg Coupon (%)"),
-              "rating:N"
+  line_chart = {
+      "mark": {"type": "line", "point": True},  # points on the line
+      "encoding": {
+          "x": {"field": "rating", "type": "nominal", "sort": "descending"},
+          "y": {
+              "field": "avg_coupon", "type": "quantitative",
+              "title": "Average Coupon (%)"
+          },
+          "color": {"field": "state", "type": "nominal", "title": "State"},
+          "tooltip": [
+              {"field": "state", "type": "nominal"},
+              {"field": "avg_coupon", "type": "quantitative", "title": "Avg Coupon (%)"},
+              {"field": "rating", "type": "nominal"},
           ],
-      )
-      .interactive()
-      .properties(height=300)
-  )
+      },
+      "params": [{"name": "zoom", "select": "interval", "bind": "scales"}],
+      "height": 300,
+  }
 
-  st.altair_chart(line_chart, use_container_width=True)
+  st.vega_lite_chart(by_rating_state, line_chart, use_container_width=True)
   st.divider()
 
   # avg yield by credit rating
   st.subheader("Average Yield by Credit Rating")
   
-  bar = (
-      alt.Chart(df)
-      .mark_bar()
-      .encode(
-          x=alt.X("rating:N", sort="descending", title="Credit Rating"),
-          y=alt.Y("mean(coupon_rate):Q", title="Avg Coupon (%)"),
-          tooltip=[
-              alt.Tooltip("rating:N", title="Rating"),
-              alt.Tooltip("mean(coupon_rate):Q", title="Avg Coupon", format=".2f")
+  bar = {
+      "mark": "bar",
+      "encoding": {
+          "x": {
+              "field": "rating", "type": "nominal", "sort": "descending",
+              "title": "Credit Rating"
+          },
+          "y": {"field": "avg_coupon", "type": "quantitative", "title": "Avg Coupon (%)"},
+          "tooltip": [
+              {"field": "rating", "type": "nominal", "title": "Rating"},
+              {
+                  "field": "avg_coupon", "type": "quantitative",
+                  "title": "Avg Coupon", "format": ".2f"
+              },
           ],
-          color=alt.Color("rating:N", legend=None)
-      )
-      .properties(height=300)
-  )
+          "color": {"field": "rating", "type": "nominal", "legend": None},
+      },
+      "height": 300,
+  }
   
-  st.altair_chart(bar, use_container_width=True)
+  st.vega_lite_chart(by_rating, bar, use_container_width=True)
   st.divider()
 
   # recent rating changes
   st.subheader("Latest Rating Updates")
   
-  recent_updates = (
-    df.sort_values("rating_date", ascending=False)
-    .groupby("cusip")
-    .head(1)  # latest rating per bond
-    .head(10) # show 10 newest
-    .sort_values("rating_date", ascending=False)
-  )
-  
-  st.table(
-    recent_updates[["rating_date", "cusip", "issuer_name", "rating", "outlook"]]
-  )
+  st.table(recent_updates)
   st.divider()
 
   # highest-risk (lowest rated) bonds
   st.subheader("Highest-Risk Bonds")
   
-  # Sort ratings low to high
-  RATING_ORDER = [ # i think this is right?
-    "AAA", "AA+", "AA", "AA-", "A+", "A", "A-",
-    "BBB+", "BBB", "BBB-", "BB+", "BB", "BB-",
-    "B+", "B", "B-", "CCC+", "CCC", "CCC-", "CC",
-    "C", "D"
-  ]
-  
-  df["rating_sort"] = df["rating"].apply(
-    lambda r: RATING_ORDER.index(r) if r in RATING_ORDER else 999
-  )
-  risky = df.sort_values("rating_sort", ascending=False).head(10)
   st.table(
     risky[["rating", "outlook", "cusip", "issuer_name", "coupon_rate"]]
   )
 
+# the CUSIP list barely changes, so keep it around for an hour
+@st.cache_data(ttl = "1h")
+def all_cusips():
+  df = read_sql("SELECT cusip FROM bonds ORDER BY cusip;")
+  return df["cusip"].tolist()
+
 # the bond explorer page's code all goes in here
+@st.fragment
 def render_bond_explorer():
   st.header("🔍 Bond Explorer") # TODO emoji is bad idea? or nah
 
-  cusips_df = conn.query(
-    "SELECT cusip FROM bonds ORDER BY cusip;",
-    ttl="5m"
-  )
-  selected_cusip = st.selectbox(
-    "Select a bond (CUSIP)", cusips_df["cusip"].tolist()
-  )
+  render_bond_details(all_cusips())
+
+# the CUSIP picker and everything under it; its own fragment so switching
+# bonds doesn't go back through the CUSIP list
+@st.fragment
+def render_bond_details(cusips):
+  selected_cusip = remember("bond_cusip", st.selectbox(
+    "Select a bond (CUSIP)", cusips, key = "bond_cusip",
+    index = remembered_index("bond_cusip", cusips),
+  ))
 
   if not selected_cusip:
     return
@@ -359,33 +564,55 @@ def render_bond_explorer():
 
   selected_cusip = selected_cusip.strip() # remove leading/trailing whitespace
 
-  # getting bond metadata
+  # getting bond metadata, its trades averaged per day for the charts, and
+  # its latest trade for the metrics, all in a single round trip
   bond_sql = """
+    WITH meta AS (
+      SELECT
+        b.id AS bond_id,
+        b.cusip, b.type, b.coupon_rate, b.issue_date, b.maturity_date,
+        b.duration, b.tax_status,
+        bp.category AS purpose_category, bp.description AS purpose_description,
+        i.name AS issuer_name, i.state AS issuer_state
+      FROM bonds b
+      JOIN bonds_purposes bp ON b.purpose_id = bp.id
+      LEFT JOIN bonds_issuers bi ON bi.bond_id = b.id
+      LEFT JOIN issuers i ON bi.issuer_id = i.id
+      WHERE b.cusip = :cusip
+      LIMIT 1
+    ), tr AS (
+      SELECT t.date, t.price, t.yield
+      FROM trades t
+      JOIN bonds_trades bt ON bt.trade_id = t.id
+      JOIN bonds b ON b.id = bt.bond_id
+      WHERE b.cusip = :cusip
+    ), daily AS (
+      SELECT
+        date_trunc('day', tr.date)::date AS date,
+        avg(tr.price) AS price, avg(tr.yield) AS yield
+      FROM tr
+      GROUP BY 1
+    ), latest AS (
+      SELECT * FROM tr ORDER BY tr.date DESC LIMIT 1
+    )
     SELECT
-      b.id AS bond_id,
-      b.cusip, b.type, b.coupon_rate, b.issue_date, b.maturity_date,
-      b.duration, b.tax_status,
-      bp.category AS purpose_category, bp.description AS purpose_description,
-      i.name AS issuer_name, i.state AS issuer_state
-    FROM bonds b
-    JOIN bonds_purposes bp ON b.purpose_id = bp.id
-    LEFT JOIN bonds_issuers bi ON bi.bond_id = b.id
-    LEFT JOIN issuers i ON bi.issuer_id = i.id
-    WHERE b.cusip = :cusip
-    LIMIT 1;
+      (SELECT row_to_json(meta) FROM meta) AS meta_json,
+      (SELECT json_agg(daily ORDER BY daily.date) FROM daily) AS trades_json,
+      (SELECT row_to_json(latest) FROM latest) AS latest_json;
   """
 
-  bond_df = conn.query(
+  bond_df = get_conn().query(
     bond_sql,
     params = {"cusip": selected_cusip},
     ttl="5m"
   )
+  meta = bond_df.iloc[0]["meta_json"]
 
-  if bond_df.empty:
+  if meta is None:
     st.warning("No metadata found for this bond.")
     return
 
-  bond = bond_df.iloc[0]
+  bond = pd.Series(meta)
 
   # display bond metadata
   st.subheader("Bond Summary")
@@ -402,20 +629,15 @@ def render_bond_explorer():
   st.divider()
 
   # trades
-  trades_sql = """
-    SELECT t.date, t.price, t.yield, t.quantity
-    FROM trades t
-    JOIN bonds_trades bt ON bt.trade_id = t.id
-    JOIN bonds b ON b.id = bt.bond_id
-    WHERE b.cusip = :cusip
-    ORDER BY t.date;
-  """
-  trades = conn.query(trades_sql, params = {"cusip": selected_cusip}, ttl = "5m")
+  trades_json = bond_df.iloc[0]["trades_json"]
   
-  if trades.empty:
+  if not trades_json:
     st.warning("No trades found for this bond")
     return
 
+  trades = pd.DataFrame(trades_json)
+  trades["date"] = pd.to_datetime(trades["date"]) # json hands dates back as text
+
   # funky visualizations
   st.subheader("Price over Time")
   st.line_chart(trades.set_index("date")["price"])
@@ -426,23 +648,30 @@ def render_bond_explorer():
   st.divider()
 
   # metrics
-  last_row = trades.iloc[-1]
+  last_row = bond_df.iloc[0]["latest_json"]
   col1, col2, col3 = st.columns(3)
   col1.metric("Latest Price", f"${last_row['price']:.2f}")
   col2.metric("Latest Yield", f"{last_row['yield']:.2f}%")
-  col3.metric("Last Trade Date", str(last_row['date']))
+  col3.metric("Last Trade Date", str(pd.Timestamp(last_row['date']))) # json text
 
+@st.fragment
 def render_state_compare():
     st.header("State Compare")
 
     # loading filter values
-    state_list = conn.query(
+    state_list = get_conn().query(
         "SELECT DISTINCT state FROM issuers ORDER BY state;", ttl="10m"
     )["state"].tolist()
 
     c1, c2 = st.columns(2)
-    selected_state_1 = c1.selectbox("State A", state_list)
-    selected_state_2 = c2.selectbox("State B", state_list)
+    selected_state_1 = remember("compare_state_a", c1.selectbox(
+        "State A", state_list, key="compare_state_a",
+        index=remembered_index("compare_state_a", state_list),
+    ))
+    selected_state_2 = remember("compare_state_b", c2.selectbox(
+        "State B", state_list, key="compare_state_b",
+        index=remembered_index("compare_state_b", state_list),
+    ))
 
     if selected_state_1 == selected_state_2:
         st.warning("Select two different states")
@@ -471,8 +700,10 @@ def render_state_compare():
         ORDER BY cr.date DESC;
     """
 
-    # Execute query
-    df = conn.query(sql, params=params, ttl="2m")
+    # Execute query; arrow-backed strings hash faster than python objects in
+    # the rating groupbys below
+    df = get_conn().query(sql, params=params, ttl="2m")
+    df = df.convert_dtypes(dtype_backend="pyarrow")
 
     if df.empty:
         st.warning("No rating data available for the selected states.")
@@ -481,9 +712,13 @@ def render_state_compare():
     # parse date
     df["rating_date"] = pd.to_datetime(df["rating_date"])
 
+    # the two states are known up front, so group on a categorical instead of
+    # hashing strings; unobserved categories keep a row for a state with no data
+    df["state"] = pd.Categorical(df["state"], categories=selected_states)
+
     # Summary metrics per state
     st.subheader("Summary Metrics")
-    metrics = df.groupby("state").agg(
+    metrics = df.groupby("state", observed=False).agg(
         total_bonds=("cusip", "count"),
         avg_coupon=("coupon_rate", "mean"),
         unique_ratings=("rating", "nunique")
@@ -502,62 +737,94 @@ def render_state_compare():
             c3.metric(f"{state} - Unique Ratings", state_metrics["unique_ratings"])
     st.divider()
 
+    # both charts below only need per (state, rating) counts and averages,
+    # so aggregate here and send a few dozen rows instead of every rating
+    by_state_rating = df.groupby(
+        ["state", "rating"], observed=True, dropna=False
+    ).agg(
+        bonds=("coupon_rate", "size"),
+        avg_coupon=("coupon_rate", "mean"),
+    ).reset_index()
+
     # Rating distribution side by side
     st.subheader("Distribution of Credit Ratings by State")
     c1, c2 = st.columns(2)
 
     for i, state in enumerate([selected_state_1, selected_state_2]):
-      state_df = df[df["state"] == state]
-
-      chart = (
-          alt.Chart(state_df)
-          .mark_bar()
-          .encode(
-              x=alt.X("rating:N", sort="descending", title="Rating"),
-              y=alt.Y("count()", title="Number of Bonds"),
-              color=alt.Color("rating:N", legend=None),
-              tooltip=["rating:N", "count()"]
-          )
-          .properties(height=300, width=350)
-      )
+      state_df = by_state_rating[by_state_rating["state"] == state]
+
+      chart = {
+          "mark": "bar",
+          "encoding": {
+              "x": {
+                  "field": "rating", "type": "nominal", "sort": "descending",
+                  "title": "Rating"
+              },
+              "y": {"field": "bonds", "type": "quantitative", "title": "Number of Bonds"},
+              "color": {"field": "rating", "type": "nominal", "legend": None},
+              "tooltip": [
+                  {"field": "rating", "type": "nominal"},
+                  {"field": "bonds", "type": "quantitative"},
+              ],
+          },
+          "height": 300,
+      }
 
       if i == 0:
           c1.subheader(state)  # Use subheader inside the column
-          c1.altair_chart(chart, use_container_width=True)
+          c1.vega_lite_chart(state_df, chart, use_container_width=True)
       else:
           c2.subheader(state)  # Use subheader inside the column
-          c2.altair_chart(chart, use_container_width=True)
+          c2.vega_lite_chart(state_df, chart, use_container_width=True)
 
     st.divider()
 
     # Yield vs rating per state
     st.subheader("Yield (Coupon) vs Credit Rating")
-    line_chart = (
-        alt.Chart(df)
-        .mark_line(point=True)
-        .encode(
-            x=alt.X("rating:N", sort="descending"),
-            y=alt.Y("mean(coupon_rate):Q", title="Average Coupon (%)"),
-            color=alt.Color("state:N", title="State"),
-            tooltip=[
-                "state:N",
-                alt.Tooltip("mean(coupon_rate):Q", title="Avg Coupon (%)"),
-                "rating:N"
+    line_chart = {
+        "mark": {"type": "line", "point": True},
+        "encoding": {
+            "x": {"field": "rating", "type": "nominal", "sort": "descending"},
+            "y": {
+                "field": "avg_coupon", "type": "quantitative",
+                "title": "Average Coupon (%)"
+            },
+            "color": {"field": "state", "type": "nominal", "title": "State"},
+            "tooltip": [
+                {"field": "state", "type": "nominal"},
+                {"field": "avg_coupon", "type": "quantitative", "title": "Avg Coupon (%)"},
+                {"field": "rating", "type": "nominal"},
             ],
-        )
-        .interactive()
-        .properties(height=300)
-    )
-    st.altair_chart(line_chart, use_container_width=True)
-
-with bonds_tab:
-  render_bond_explorer()
-
-with risk_tab:
-  render_ratings_risk()
-
-with market_tab:
-  render_market_overview()
+        },
+        "params": [{"name": "zoom", "select": "interval", "bind": "scales"}],
+        "height": 300,
+    }
+    st.vega_lite_chart(by_state_rating, line_chart, use_container_width=True)
+
+def main():
+  # main heading
+  st.header("📊 M U N I S")
+  # st.subheader("A dashboard for the municipal bond market")
+
+  # our tabs; st.tabs would run every tab's queries on each rerun, so only
+  # the one picked here gets rendered
+  active_tab = st.radio(
+    "Page",
+    ["Market Overview", "Bond Explorer", "Ratings & Risk", "State Compare"],
+    horizontal = True,
+    label_visibility = "collapsed",
+    key = "active_tab",
+  )
 
-with state_compare_tab:
-  render_state_compare()
+  if active_tab == "Market Overview":
+    render_market_overview()
+  elif active_tab == "Bond Explorer":
+    render_bond_explorer()
+  elif active_tab == "Ratings & Risk":
+    render_ratings_risk()
+  elif active_tab == "State Compare":
+    render_state_compare()
+
+# streamlit runs the script as __main__, importing it has no side effects
+if __name__ == "__main__":
+  main()
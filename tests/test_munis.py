@@ -0,0 +1,45 @@
+from pathlib import Path
+
+import pytest
+
+AppTest = pytest.importorskip("streamlit.testing.v1").AppTest
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# these run the real app, so they need the database from the README
+pytestmark = pytest.mark.skipif(
+  not (ROOT / ".streamlit" / "secrets.toml").exists(),
+  reason = "needs .streamlit/secrets.toml pointing at the munis database",
+)
+
+def run_app():
+  at = AppTest.from_file(str(ROOT / "munis.py"), default_timeout = 60).run()
+  assert not at.exception
+  return at
+
+def switch_to(at, page):
+  at.radio(key = "active_tab").set_value(page).run()
+  assert not at.exception
+
+def test_market_filters_survive_page_switch():
+  at = run_app()
+  state = at.multiselect(key = "market_states").options[0]
+  at.multiselect(key = "market_states").select(state).run()
+
+  switch_to(at, "Bond Explorer")
+  switch_to(at, "Market Overview")
+
+  assert at.multiselect(key = "market_states").value == [state]
+
+def test_selected_cusip_survives_page_switch():
+  at = run_app()
+  switch_to(at, "Bond Explorer")
+  cusips = at.selectbox(key = "bond_cusip").options
+  if len(cusips) < 2:
+    pytest.skip("needs at least two bonds")
+  at.selectbox(key = "bond_cusip").set_value(cusips[1]).run()
+
+  switch_to(at, "Ratings & Risk")
+  switch_to(at, "Bond Explorer")
+
+  assert at.selectbox(key = "bond_cusip").value == cusips[1]